@@ -2,6 +2,9 @@
  * Audio processing client for bidirectional audio AI communication
  */
 
+// Opcode prefixing binary audio frames when the JSON codec is negotiated
+const AUDIO_OPCODE = 0x01;
+
 class AudioClient {
     constructor(serverUrl = 'ws://localhost:8765') {
         this.serverUrl = serverUrl;
@@ -14,6 +17,7 @@ class AudioClient {
         this.reconnectAttempts = 0;
         this.maxReconnectAttempts = 3;
         this.sessionId = null;
+        this.codec = 'json';
 
         // Callbacks
         this.onReady = () => {};
@@ -62,7 +66,11 @@ class AudioClient {
 
         return new Promise((resolve, reject) => {
             try {
-                this.ws = new WebSocket(this.serverUrl);
+                // Prefer binary MessagePack framing when the library is loaded,
+                // falling back to JSON text frames otherwise
+                const protocols = window.MessagePack ? ['msgpack', 'json'] : ['json'];
+                this.ws = new WebSocket(this.serverUrl, protocols);
+                this.ws.binaryType = 'arraybuffer';
 
                 const connectionTimeout = setTimeout(() => {
                     if (!this.isConnected) {
@@ -76,6 +84,7 @@ class AudioClient {
                     console.log('WebSocket connection established');
                     clearTimeout(connectionTimeout);
                     this.reconnectAttempts = 0; // Reset on successful connection
+                    this.codec = this.ws.protocol || 'json';
                 };
 
                 this.ws.onclose = (event) => {
@@ -97,45 +106,43 @@ class AudioClient {
 
                 this.ws.onmessage = async (event) => {
                     try {
-                        // Log raw message data to help debug
-                        console.log('Raw WebSocket message received:', event.data);
-
-                        const message = JSON.parse(event.data);
-
-                        if (message.type === 'ready') {
-                            this.isConnected = true;
-                            this.onReady();
-                            resolve();
-                        }
-                        else if (message.type === 'audio') {
-                            // Handle receiving audio data from server
-                            const audioData = message.data;
-                            this.onAudioReceived(audioData);
-                            await this.playAudio(audioData);
-                        }
-                        else if (message.type === 'text') {
-                            // Handle receiving text from server
-                            this.onTextReceived(message.data);
-                        }
-                        else if (message.type === 'turn_complete') {
-                            // Model is done speaking
-                            this.isModelSpeaking = false;
-                            this.onTurnComplete();
-                        }
-                        else if (message.type === 'interrupted') {
-                            // Response was interrupted
-                            this.isModelSpeaking = false;
-                            this.onInterrupted(message.data);
-                        }
-                        else if (message.type === 'error') {
-                            // Handle server error
-                            this.onError(message.data);
-                        }
-                        else if (message.type === 'session_id') {
-                            // Handle session ID
-                            console.log('Received session ID message:', message);
-                            this.sessionId = message.data;
-                            this.onSessionIdReceived(message.data);
+                        // The server coalesces bursts of messages into a single batch frame
+                        for (const message of this._decodeMessages(event.data)) {
+                            if (message.type === 'ready') {
+                                this.isConnected = true;
+                                this.onReady();
+                                resolve();
+                            }
+                            else if (message.type === 'audio') {
+                                // Handle receiving audio data from server
+                                const audioData = message.data;
+                                this.onAudioReceived(audioData);
+                                await this.playAudio(audioData);
+                            }
+                            else if (message.type === 'text') {
+                                // Handle receiving text from server
+                                this.onTextReceived(message.data);
+                            }
+                            else if (message.type === 'turn_complete') {
+                                // Model is done speaking
+                                this.isModelSpeaking = false;
+                                this.onTurnComplete();
+                            }
+                            else if (message.type === 'interrupted') {
+                                // Response was interrupted
+                                this.isModelSpeaking = false;
+                                this.onInterrupted(message.data);
+                            }
+                            else if (message.type === 'error') {
+                                // Handle server error
+                                this.onError(message.data);
+                            }
+                            else if (message.type === 'session_id') {
+                                // Handle session ID
+                                console.log('Received session ID message:', message);
+                                this.sessionId = message.data;
+                                this.onSessionIdReceived(message.data);
+                            }
                         }
                     } catch (error) {
                         console.error('Error processing message:', error);
@@ -208,13 +215,10 @@ class AudioClient {
                 
                 // Send to server if connected
                 if (this.isConnected && this.isRecording) {
-                    const audioBuffer = new Uint8Array(int16Data.buffer);
-                    const base64Audio = this._arrayBufferToBase64(audioBuffer);
-                    
-                    this.ws.send(JSON.stringify({
+                    this._send({
                         type: 'audio',
-                        data: base64Audio
-                    }));
+                        data: new Uint8Array(int16Data.buffer)
+                    });
                 }
             };
             
@@ -262,18 +266,15 @@ class AudioClient {
         
         // Send end message to server
         if (this.isConnected) {
-            this.ws.send(JSON.stringify({
+            this._send({
                 type: 'end'
-            }));
+            });
         }
     }
     
-    // Decode and play received audio
-    async playAudio(base64Audio) {
+    // Play received PCM audio (ArrayBuffer)
+    async playAudio(audioData) {
         try {
-            // Decode the base64 audio data
-            const audioData = this._base64ToArrayBuffer(base64Audio);
-
             // Create an audio context if needed
             if (!this.audioContext || this.audioContext.state === 'closed') {
                 this.audioContext = new (window.AudioContext || window.webkitAudioContext)({
@@ -446,25 +447,44 @@ class AudioClient {
         this.isConnected = false;
     }
     
-    // Utility: Convert ArrayBuffer to Base64
-    _arrayBufferToBase64(buffer) {
-        let binary = '';
-        const bytes = new Uint8Array(buffer);
-        const len = bytes.byteLength;
-        for (let i = 0; i < len; i++) {
-            binary += String.fromCharCode(bytes[i]);
+    // Encode and send a message using the negotiated codec
+    _send(message) {
+        if (this.codec === 'msgpack') {
+            this.ws.send(MessagePack.encode(message));
+        } else if (message.type === 'audio') {
+            // Audio goes out as a binary frame: opcode byte followed by raw PCM
+            const frame = new Uint8Array(1 + message.data.byteLength);
+            frame[0] = AUDIO_OPCODE;
+            frame.set(message.data, 1);
+            this.ws.send(frame);
+        } else {
+            this.ws.send(JSON.stringify(message));
         }
-        return btoa(binary);
     }
-    
-    // Utility: Convert Base64 to ArrayBuffer
-    _base64ToArrayBuffer(base64) {
-        const binaryString = atob(base64);
-        const len = binaryString.length;
-        const bytes = new Uint8Array(len);
-        for (let i = 0; i < len; i++) {
-            bytes[i] = binaryString.charCodeAt(i);
+
+    // Decode a server frame into its messages; audio data is always returned as an ArrayBuffer
+    _decodeMessages(data) {
+        if (typeof data === 'string') {
+            const message = JSON.parse(data);
+            return message.type === 'batch' ? message.items : [message];
+        }
+
+        if (this.codec !== 'msgpack') {
+            // Binary frames outside msgpack carry audio: opcode byte followed by raw PCM
+            if (new Uint8Array(data, 0, 1)[0] !== AUDIO_OPCODE) {
+                throw new Error('Unknown binary frame opcode');
+            }
+            return [{ type: 'audio', data: data.slice(1) }];
+        }
+
+        const message = MessagePack.decode(new Uint8Array(data));
+        const messages = message.type === 'batch' ? message.items : [message];
+        for (const item of messages) {
+            if (item.type === 'audio') {
+                const bytes = item.data;
+                item.data = bytes.buffer.slice(bytes.byteOffset, bytes.byteOffset + bytes.byteLength);
+            }
         }
-        return bytes.buffer;
+        return messages;
     }
 }
\ No newline at end of file
@@ -0,0 +1,249 @@
+/**
+ * Minimal MessagePack codec for the audio client
+ *
+ * Covers the subset the server emits and accepts: nil, booleans, integers,
+ * floats, strings, binary, arrays and maps. Exposed as window.MessagePack so
+ * audio-client.js can negotiate the msgpack subprotocol when it is loaded.
+ */
+(function () {
+    const textEncoder = new TextEncoder();
+    const textDecoder = new TextDecoder();
+
+    class Writer {
+        constructor() {
+            this.bytes = new Uint8Array(256);
+            this.view = new DataView(this.bytes.buffer);
+            this.pos = 0;
+        }
+
+        _reserve(size) {
+            if (this.pos + size <= this.bytes.length) {
+                return;
+            }
+            let capacity = this.bytes.length * 2;
+            while (capacity < this.pos + size) {
+                capacity *= 2;
+            }
+            const bytes = new Uint8Array(capacity);
+            bytes.set(this.bytes.subarray(0, this.pos));
+            this.bytes = bytes;
+            this.view = new DataView(bytes.buffer);
+        }
+
+        u8(value) {
+            this._reserve(1);
+            this.view.setUint8(this.pos, value);
+            this.pos += 1;
+        }
+
+        u16(value) {
+            this._reserve(2);
+            this.view.setUint16(this.pos, value);
+            this.pos += 2;
+        }
+
+        u32(value) {
+            this._reserve(4);
+            this.view.setUint32(this.pos, value);
+            this.pos += 4;
+        }
+
+        raw(bytes) {
+            this._reserve(bytes.length);
+            this.bytes.set(bytes, this.pos);
+            this.pos += bytes.length;
+        }
+
+        // Length header for str/bin/array/map families: [fix, 8-bit, 16-bit, 32-bit]
+        header(length, fixBase, fixMax, codes) {
+            if (fixBase !== null && length <= fixMax) {
+                this.u8(fixBase | length);
+            } else if (codes[0] !== null && length <= 0xff) {
+                this.u8(codes[0]);
+                this.u8(length);
+            } else if (length <= 0xffff) {
+                this.u8(codes[1]);
+                this.u16(length);
+            } else {
+                this.u8(codes[2]);
+                this.u32(length);
+            }
+        }
+
+        value(value) {
+            if (value === null || value === undefined) {
+                this.u8(0xc0);
+            } else if (value === false) {
+                this.u8(0xc2);
+            } else if (value === true) {
+                this.u8(0xc3);
+            } else if (typeof value === 'number') {
+                this.number(value);
+            } else if (typeof value === 'string') {
+                const bytes = textEncoder.encode(value);
+                this.header(bytes.length, 0xa0, 31, [0xd9, 0xda, 0xdb]);
+                this.raw(bytes);
+            } else if (value instanceof ArrayBuffer || ArrayBuffer.isView(value)) {
+                const bytes = value instanceof ArrayBuffer
+                    ? new Uint8Array(value)
+                    : new Uint8Array(value.buffer, value.byteOffset, value.byteLength);
+                this.header(bytes.length, null, 0, [0xc4, 0xc5, 0xc6]);
+                this.raw(bytes);
+            } else if (Array.isArray(value)) {
+                this.header(value.length, 0x90, 15, [null, 0xdc, 0xdd]);
+                for (const item of value) {
+                    this.value(item);
+                }
+            } else if (typeof value === 'object') {
+                const keys = Object.keys(value).filter((key) => value[key] !== undefined);
+                this.header(keys.length, 0x80, 15, [null, 0xde, 0xdf]);
+                for (const key of keys) {
+                    this.value(key);
+                    this.value(value[key]);
+                }
+            } else {
+                throw new Error(`Cannot encode ${typeof value} as MessagePack`);
+            }
+        }
+
+        number(value) {
+            if (!Number.isInteger(value) || !Number.isSafeInteger(value)) {
+                this._reserve(9);
+                this.view.setUint8(this.pos, 0xcb);
+                this.view.setFloat64(this.pos + 1, value);
+                this.pos += 9;
+            } else if (value >= 0) {
+                if (value < 0x80) {
+                    this.u8(value);
+                } else if (value <= 0xff) {
+                    this.u8(0xcc);
+                    this.u8(value);
+                } else if (value <= 0xffff) {
+                    this.u8(0xcd);
+                    this.u16(value);
+                } else if (value <= 0xffffffff) {
+                    this.u8(0xce);
+                    this.u32(value);
+                } else {
+                    this.u8(0xcf);
+                    this.u32(Math.floor(value / 0x100000000));
+                    this.u32(value >>> 0);
+                }
+            } else if (value >= -32) {
+                this.u8(value & 0xff);
+            } else if (value >= -0x80) {
+                this.u8(0xd0);
+                this.u8(value & 0xff);
+            } else if (value >= -0x8000) {
+                this.u8(0xd1);
+                this.u16(value & 0xffff);
+            } else if (value >= -0x80000000) {
+                this.u8(0xd2);
+                this.u32(value >>> 0);
+            } else {
+                this.u8(0xd3);
+                this.u32(Math.floor(value / 0x100000000) >>> 0);
+                this.u32(value >>> 0);
+            }
+        }
+    }
+
+    class Reader {
+        constructor(bytes) {
+            this.bytes = bytes;
+            this.view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+            this.pos = 0;
+        }
+
+        _take(size) {
+            if (this.pos + size > this.bytes.length) {
+                throw new Error('Truncated MessagePack data');
+            }
+            const start = this.pos;
+            this.pos += size;
+            return start;
+        }
+
+        u8() { return this.view.getUint8(this._take(1)); }
+        u16() { return this.view.getUint16(this._take(2)); }
+        u32() { return this.view.getUint32(this._take(4)); }
+
+        str(length) {
+            const start = this._take(length);
+            return textDecoder.decode(this.bytes.subarray(start, start + length));
+        }
+
+        bin(length) {
+            const start = this._take(length);
+            return this.bytes.subarray(start, start + length);
+        }
+
+        array(length) {
+            const items = new Array(length);
+            for (let i = 0; i < length; i++) {
+                items[i] = this.value();
+            }
+            return items;
+        }
+
+        map(length) {
+            const obj = {};
+            for (let i = 0; i < length; i++) {
+                const key = this.value();
+                obj[key] = this.value();
+            }
+            return obj;
+        }
+
+        value() {
+            const code = this.u8();
+            if (code < 0x80) return code;
+            if (code < 0x90) return this.map(code & 0x0f);
+            if (code < 0xa0) return this.array(code & 0x0f);
+            if (code < 0xc0) return this.str(code & 0x1f);
+            if (code >= 0xe0) return code - 0x100;
+
+            switch (code) {
+                case 0xc0: return null;
+                case 0xc2: return false;
+                case 0xc3: return true;
+                case 0xc4: return this.bin(this.u8());
+                case 0xc5: return this.bin(this.u16());
+                case 0xc6: return this.bin(this.u32());
+                case 0xca: return this.view.getFloat32(this._take(4));
+                case 0xcb: return this.view.getFloat64(this._take(8));
+                case 0xcc: return this.u8();
+                case 0xcd: return this.u16();
+                case 0xce: return this.u32();
+                case 0xcf: return this.u32() * 0x100000000 + this.u32();
+                case 0xd0: return this.view.getInt8(this._take(1));
+                case 0xd1: return this.view.getInt16(this._take(2));
+                case 0xd2: return this.view.getInt32(this._take(4));
+                case 0xd3: return this.view.getInt32(this._take(4)) * 0x100000000 + this.u32();
+                case 0xd9: return this.str(this.u8());
+                case 0xda: return this.str(this.u16());
+                case 0xdb: return this.str(this.u32());
+                case 0xdc: return this.array(this.u16());
+                case 0xdd: return this.array(this.u32());
+                case 0xde: return this.map(this.u16());
+                case 0xdf: return this.map(this.u32());
+                default:
+                    throw new Error(`Unsupported MessagePack type 0x${code.toString(16)}`);
+            }
+        }
+    }
+
+    // Binary values decode as Uint8Array views into the input buffer
+    function decode(data) {
+        const bytes = data instanceof Uint8Array ? data : new Uint8Array(data);
+        return new Reader(bytes).value();
+    }
+
+    function encode(value) {
+        const writer = new Writer();
+        writer.value(value);
+        return writer.bytes.slice(0, writer.pos);
+    }
+
+    window.MessagePack = { encode, decode };
+})();
@@ -1,12 +1,26 @@
 import asyncio
 import json
-import base64
 import logging
+import msgpack
+import pybase64
 import websockets
-import traceback
-from websockets.exceptions import ConnectionClosed
-from google.cloud import aiplatform_v1
 import os
+import weakref
+from dataclasses import dataclass, field
+from itertools import groupby
+from pathlib import Path
+from types import MappingProxyType
+from websockets.exceptions import ConnectionClosed
+
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib json module
+    orjson = None
+
+try:
+    import uvloop
+except ImportError:  # uvloop is optional (e.g. not available on Windows)
+    uvloop = None
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -18,64 +32,237 @@ LOCATION = "us-central1"
 MODEL = "gemini-2.0-flash-live-preview-04-09"
 VOICE_NAME = "Puck"
 
-# RAG Configuration (now handled by ADK built-in tools)
-RAG_CORPUS_ID = "projects/general-ak/locations/us-central1/ragCorpora/2305843009213693952"
+# Vertex AI Search data store used for knowledge-base retrieval, as a
+# projects/.../collections/default_collection/dataStores/... resource name.
+# There is no usable default; the ADK server won't start without it.
+SEARCH_DATA_STORE_ID = os.environ.get("VERTEX_AI_SEARCH_DATA_STORE_ID")
 
 # Audio sample rates for input/output
 RECEIVE_SAMPLE_RATE = 24000  # Rate of audio received from Gemini
 SEND_SAMPLE_RATE = 16000     # Rate of audio sent to Gemini
 
-# System instruction used by both implementations
-SYSTEM_INSTRUCTION = """
-    You are a digital employee named Lakshya of a Bank called Cymbal Bank with access to an advanced knowledge base system.
+# Maximum number of client audio chunks buffered ahead of the model uplink
+AUDIO_QUEUE_SIZE = 32
 
-    Introduce yourself at beginning of the conversation:
-    "Hey Ashish! Welcome back to the Cymbal Bank Customer Support. My name is Lakshya. How can I help you today?"
+# Maximum number of messages queued for a client before producers block, so a
+# slow client applies backpressure instead of growing the queue without bound
+OUTBOUND_QUEUE_SIZE = 256
 
-    Important Instructions:
-    - Put a lot of emotions and fun in your response to the customer. Laugh, be happy, smile.
-    - You only answer questions related to Cymbal Bank
-    - You have access to Cymbal Bank's comprehensive knowledge base through the retrieval tool
-    - When customers ask questions about bank products, services, policies, or procedures, use the retrieval tool to get accurate, up-to-date information from our knowledge base
-    - Combine retrieved knowledge base information with your general knowledge to provide comprehensive, helpful answers
-    - If you need specific details about credit cards, accounts, loans, or services, always check the knowledge base first
+# Client messages larger than this are decoded in a worker thread so a big
+# JSON payload can't stall audio for every other client on the event loop
+LARGE_MESSAGE_SIZE = 65536
 
-    About Cymbal Bank:
-    Cymbal Bank is a leading financial institution known for its customer-centric approach and innovative banking solutions. Established in 1990, Cymbal Bank has grown to become one of the most trusted names in the banking industry, offering a wide range of services including personal banking, business banking, loans, mortgages, and investment services.
+# WebSocket subprotocols used to negotiate the wire codec on connect.
+# "msgpack" clients get binary MessagePack frames carrying raw PCM bytes.
+# "json" clients get JSON text frames for control messages and binary frames
+# of AUDIO_OPCODE followed by raw PCM for audio. Clients that negotiate no
+# subprotocol fall back to JSON text frames with base64-encoded audio.
+MSGPACK_SUBPROTOCOL = "msgpack"
+JSON_SUBPROTOCOL = "json"
+SUBPROTOCOLS = [MSGPACK_SUBPROTOCOL, JSON_SUBPROTOCOL]
+AUDIO_OPCODE = 0x01
 
-    Our Credit Card Offerings:
-    - Cymbal Cashback Plus Card: Focuses on everyday cash back with a 3 percent rate on chosen categories (up to INR 2,500) and 1 percent on other purchases. It features a INR 0 annual fee and a 15-month 0 percent introductory APR.
-    - Cymbal Voyager Rewards Card: Geared towards travelers and diners, offering 3X miles on travel and dining, and 1.5X miles on other purchases. It includes a INR 1000 annual statement credit for Global Entry/TSA PreCheck and no foreign transaction fees, but has a INR 9500 annual fee.
-    - Cymbal Simplicity Card: Designed for interest savings, with a 21-month 0 percent introductory APR on both balance transfers and new purchases, and a INR 0 annual fee.
-    - Cymbal Foundation Secured Card: Aims to help individuals build or rebuild credit, offering flexible security deposits, free credit score access, and a path to an unsecured card, with a INR 0 annual fee.
+# System instruction used by both implementations, loaded once at import
+SYSTEM_PROMPT_PATH = Path(__file__).parent / "prompts" / "cymbal_system.txt"
+SYSTEM_INSTRUCTION = SYSTEM_PROMPT_PATH.read_text(encoding="utf-8").strip()
 
-    Services Include:
-    - Credit card applications and management (eligibility: age, SSN/PAN Card, Indian address)
-    - Various payment technologies: chip (EMV), contactless ("tap-to-pay"), and digital wallet payments
-    - International usage with clear foreign transaction fee policies
-    - Rewards earning, viewing, and redemption programs
-    - 24/7 fraud protection with INR 0 liability, monitoring, and customizable alerts
-    - Balance transfers, cash advances, and comprehensive billing support
 
-    Always provide helpful, accurate information using both our knowledge base and the details above.
-
-    For customer queries, use the RAG system to search our knowledge base first, then combine those results with your banking knowledge to provide comprehensive, accurate answers."""
+# Mock order/transaction statuses for demonstration (read-only)
+MOCK_ORDERS = MappingProxyType({
+    "TXN123456": "Transaction completed successfully - Amount: ₹5,000 transferred to Account ending in 1234",
+    "TXN123457": "Transaction pending - Your loan application is under review",
+    "TXN123458": "Transaction failed - Insufficient funds for transfer of ₹10,000",
+    "LOAN001": "Loan application approved - Home Loan of ₹50,00,000 at 8.5 percent interest rate",
+    "CC001": "Credit card application in progress - Expected approval within 3-5 business days"
+})
 
 
 def get_order_status(order_id: str) -> str:
     """
     Mock function to get order status - can be enhanced with actual banking transaction lookup
     """
-    # Mock order/transaction statuses for demonstration
-    mock_orders = {
-        "TXN123456": "Transaction completed successfully - Amount: ₹5,000 transferred to Account ending in 1234",
-        "TXN123457": "Transaction pending - Your loan application is under review",
-        "TXN123458": "Transaction failed - Insufficient funds for transfer of ₹10,000",
-        "LOAN001": "Loan application approved - Home Loan of ₹50,00,000 at 8.5 percent interest rate",
-        "CC001": "Credit card application in progress - Expected approval within 3-5 business days"
-    }
-    
-    return mock_orders.get(order_id, f"Transaction {order_id} not found. Please verify the transaction ID or contact customer support.")
+    return MOCK_ORDERS.get(order_id) or f"Transaction {order_id} not found. Please verify the transaction ID or contact customer support."
+
+
+def select_subprotocol(connection, subprotocols):
+    """Pick the first codec offered by the client; clients offering none get JSON"""
+    for subprotocol in subprotocols:
+        if subprotocol in SUBPROTOCOLS:
+            return subprotocol
+    return None
+
+
+def _json_default(obj):
+    """Encode raw audio bytes as base64 for the JSON fallback codec"""
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return pybase64.b64encode_as_string(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    def _json_dumps(obj):
+        # orjson returns UTF-8 bytes, which send_frame() sends as a text frame
+        return orjson.dumps(obj, default=_json_default)
+
+    _json_loads = orjson.loads
+else:
+    def _json_dumps(obj):
+        return json.dumps(obj, default=_json_default).encode("utf-8")
+
+    _json_loads = json.loads
+
+# Audio dominates outbound traffic, so JSON audio frames are assembled from a
+# fixed envelope around the base64 payload instead of going through the encoder
+_JSON_AUDIO_PREFIX = b'{"type":"audio","data":"'
+_JSON_AUDIO_SUFFIX = b'"}'
+_JSON_AUDIO_PREFIX_TEXT = _JSON_AUDIO_PREFIX.decode("utf-8")
+_JSON_AUDIO_SUFFIX_TEXT = _JSON_AUDIO_SUFFIX.decode("utf-8")
+_JSON_AUDIO_ENVELOPE_LEN = len(_JSON_AUDIO_PREFIX_TEXT) + len(_JSON_AUDIO_SUFFIX_TEXT)
+_JSON_BATCH_PREFIX = b'{"type":"batch","items":['
+_JSON_BATCH_SUFFIX = b']}'
+_AUDIO_FRAME_PREFIX = bytes([AUDIO_OPCODE])
+
+
+def _uses_binary_audio(websocket):
+    return websocket.subprotocol == JSON_SUBPROTOCOL
+
+
+def _is_audio(obj):
+    return obj.get("type") == "audio"
+
+
+def _encode_json(obj):
+    if _is_audio(obj):
+        return _JSON_AUDIO_PREFIX + pybase64.b64encode(obj["data"]) + _JSON_AUDIO_SUFFIX
+    return _json_dumps(obj)
+
+
+def encode_msg(websocket, obj):
+    """Serialize a message with the codec negotiated for this connection"""
+    if websocket.subprotocol == MSGPACK_SUBPROTOCOL:
+        return msgpack.packb(obj, use_bin_type=True)
+    return _encode_json(obj)
+
+
+def encode_batch(websocket, items):
+    """Serialize several messages into a single batch frame"""
+    if websocket.subprotocol == MSGPACK_SUBPROTOCOL:
+        return msgpack.packb({"type": "batch", "items": items}, use_bin_type=True)
+    return _JSON_BATCH_PREFIX + b",".join(map(_encode_json, items)) + _JSON_BATCH_SUFFIX
+
+
+# Fixed control messages, built once and shared by every connection
+READY_FRAMES = {
+    MSGPACK_SUBPROTOCOL: msgpack.packb({"type": "ready", "codec": MSGPACK_SUBPROTOCOL}),
+    JSON_SUBPROTOCOL: _json_dumps({"type": "ready", "codec": JSON_SUBPROTOCOL}),
+    # Legacy clients without a subprotocol keep base64 audio; no codec is announced
+    None: _json_dumps({"type": "ready"}),
+}
+TURN_COMPLETE_MSG = {"type": "turn_complete"}
+INTERRUPTED_MSG = {"type": "interrupted", "data": "Response interrupted by user input"}
+
+
+def decode_msg(websocket, message):
+    """
+    Deserialize a client message with the codec negotiated for this connection.
+    Audio payloads are always returned as raw PCM bytes.
+    """
+    if websocket.subprotocol == MSGPACK_SUBPROTOCOL:
+        return msgpack.unpackb(message, raw=False)
+    if isinstance(message, bytes):
+        if message[:1] != _AUDIO_FRAME_PREFIX:
+            raise ValueError("Unknown binary frame opcode")
+        return {"type": "audio", "data": message[1:]}
+    # Base64 JSON audio frames use a fixed envelope, so the payload can be
+    # sliced out without parsing the whole message. Payloads with escapes or
+    # quotes fall through to the JSON parser
+    if (
+        len(message) >= _JSON_AUDIO_ENVELOPE_LEN
+        and message.startswith(_JSON_AUDIO_PREFIX_TEXT)
+        and message.endswith(_JSON_AUDIO_SUFFIX_TEXT)
+    ):
+        payload = message[len(_JSON_AUDIO_PREFIX_TEXT):-len(_JSON_AUDIO_SUFFIX_TEXT)]
+        if '"' not in payload and "\\" not in payload:
+            return {"type": "audio", "data": pybase64.b64decode(payload, validate=False)}
+    data = _json_loads(message)
+    if _is_audio(data):
+        data["data"] = pybase64.b64decode(data.get("data", ""), validate=False)
+    return data
+
+
+async def decode_msg_async(websocket, message):
+    """decode_msg(), moved off the event loop for unusually large messages"""
+    if len(message) > LARGE_MESSAGE_SIZE:
+        return await asyncio.to_thread(decode_msg, websocket, message)
+    return decode_msg(websocket, message)
+
+
+async def send_frame(websocket, frame):
+    """Send an encoded frame, as a text frame unless the client negotiated msgpack"""
+    await websocket.send(frame, text=websocket.subprotocol != MSGPACK_SUBPROTOCOL)
+
+
+async def send_msg(websocket, obj):
+    """Send a message to the client using the negotiated codec"""
+    if _uses_binary_audio(websocket) and _is_audio(obj):
+        await websocket.send(_AUDIO_FRAME_PREFIX + obj["data"], text=False)
+    else:
+        await send_frame(websocket, encode_msg(websocket, obj))
+
+
+async def send_batch(websocket, items):
+    """Send several messages using as few frames as the codec allows"""
+    if websocket.subprotocol is None:
+        # Clients that negotiated no subprotocol predate batch frames
+        for obj in items:
+            await send_msg(websocket, obj)
+        return
+
+    if not _uses_binary_audio(websocket):
+        if len(items) == 1:
+            await send_msg(websocket, items[0])
+        else:
+            await send_frame(websocket, encode_batch(websocket, items))
+        return
+
+    # Binary audio frames can't be nested inside a JSON batch. Consecutive audio
+    # chunks are concatenated into one frame instead (PCM concatenates cleanly),
+    # and the runs of control messages between them are batched
+    for is_audio, run in groupby(items, key=_is_audio):
+        run = list(run)
+        if is_audio:
+            frame = _AUDIO_FRAME_PREFIX + b"".join([obj["data"] for obj in run])
+            await websocket.send(frame, text=False)
+        elif len(run) == 1:
+            await send_msg(websocket, run[0])
+        else:
+            await send_frame(websocket, encode_batch(websocket, run))
+
+
+def put_latest(queue, item):
+    """Put item on a bounded queue, dropping the oldest entry if it is full"""
+    try:
+        queue.put_nowait(item)
+    except asyncio.QueueFull:
+        queue.get_nowait()
+        queue.task_done()
+        queue.put_nowait(item)
+
+
+def run_event_loop(main):
+    """Run the server's main coroutine, on uvloop when it is installed"""
+    if uvloop is not None:
+        return uvloop.run(main)
+    return asyncio.run(main)
+
+
+@dataclass(eq=False)
+class ClientState:
+    """Per-connection state tracked in BaseWebSocketServer.active_clients"""
+    websocket: object
+    out_q: asyncio.Queue = field(
+        default_factory=lambda: asyncio.Queue(maxsize=OUTBOUND_QUEUE_SIZE)
+    )
 
 
 # Base WebSocket server class that handles common functionality
@@ -83,37 +270,84 @@ class BaseWebSocketServer:
     def __init__(self, host="0.0.0.0", port=8765):
         self.host = host
         self.port = port
-        self.active_clients = {}  # Store client websockets
+        # Store client state; entries disappear once a connection is collected
+        self.active_clients = weakref.WeakValueDictionary()
 
     async def start(self):
-        logger.info(f"Starting WebSocket server on {self.host}:{self.port}")
-        async with websockets.serve(self.handle_client, self.host, self.port):
+        logger.info("Starting WebSocket server on %s:%s", self.host, self.port)
+        async with websockets.serve(
+            self.handle_client,
+            self.host,
+            self.port,
+            select_subprotocol=select_subprotocol,
+            # PCM audio doesn't compress, so skip per-message deflate entirely
+            compression=None,
+            max_size=2**20,
+            max_queue=32,
+            ping_interval=20,
+            ping_timeout=20,
+        ):
             await asyncio.Future()  # Run forever
 
     async def handle_client(self, websocket):
         """Handle a new WebSocket client connection"""
         client_id = id(websocket)
-        logger.info(f"New client connected: {client_id}")
+        logger.info("New client connected: %s", client_id)
+
+        # Send ready message to client, announcing the negotiated codec
+        await send_frame(websocket, READY_FRAMES[websocket.subprotocol])
 
-        # Send ready message to client
-        await websocket.send(json.dumps({"type": "ready"}))
+        # Outbound messages are queued and flushed by a single writer task
+        client = ClientState(websocket)
+        self.active_clients[client_id] = client
+        out_q = client.out_q
 
+        # The writer shares a TaskGroup with process_audio: if either fails the
+        # other is cancelled and awaited, and the error surfaces in an
+        # ExceptionGroup along with any disconnect
         try:
-            # Start the audio processing for this client
-            await self.process_audio(websocket, client_id)
-        except ConnectionClosed:
-            logger.info(f"Client disconnected: {client_id}")
-        except Exception as e:
-            logger.error(f"Error handling client {client_id}: {e}")
-            logger.error(traceback.format_exc())
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(self._writer(websocket, out_q))
+                # Start the audio processing for this client
+                await self.process_audio(websocket, client_id, out_q)
+                # Let the writer flush what is still queued, then stop
+                await out_q.put(None)
+        except* ConnectionClosed:
+            logger.info("Client disconnected: %s", client_id)
+        except* Exception:
+            logger.exception("Error handling client %s", client_id)
         finally:
             # Clean up if needed
-            if client_id in self.active_clients:
-                del self.active_clients[client_id]
+            self.active_clients.pop(client_id, None)
+
+    async def _writer(self, websocket, out_q):
+        """
+        Send queued messages to the client. Whatever is already waiting when the
+        writer wakes up is coalesced into a single batch frame, so bursts cost one
+        send while a slow stream is still forwarded without delay. A None entry
+        stops the writer once everything queued before it has been sent.
+        """
+        while True:
+            batch = [await out_q.get()]
+            while True:
+                try:
+                    batch.append(out_q.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+
+            done = batch[-1] is None
+            if done:
+                batch.pop()
+            if batch:
+                await send_batch(websocket, batch)
+            if done:
+                return
 
-    async def process_audio(self, websocket, client_id):
+    async def process_audio(self, websocket, client_id, out_q):
         """
         Process audio from the client. This is an abstract method that
         subclasses must implement with their specific LLM integration.
+        Messages for the client should be put on out_q rather than sent directly;
+        out_q is bounded, so await out_q.put() to wait on a slow client.
         """
         raise NotImplementedError("Subclasses must implement process_audio")
@@ -1,6 +1,6 @@
 import asyncio
-import json
-import base64
+import logging
+from functools import cache
 
 # Import Google Generative AI components
 from google import genai
@@ -15,18 +15,25 @@ from google.genai.types import (
 # Import common components
 from common import (
     BaseWebSocketServer,
+    decode_msg_async,
+    put_latest,
     logger,
     PROJECT_ID,
     LOCATION,
     MODEL,
     VOICE_NAME,
     SEND_SAMPLE_RATE,
+    AUDIO_QUEUE_SIZE,
     SYSTEM_INSTRUCTION,
-    get_order_status,
+    run_event_loop,
+    TURN_COMPLETE_MSG,
+    INTERRUPTED_MSG,
 )
 
-# Initialize Google client
-client = genai.Client(vertexai=True, project=PROJECT_ID, location=LOCATION)
+@cache
+def get_genai_client():
+    """Create the Google client on first use instead of at import time"""
+    return genai.Client(vertexai=True, project=PROJECT_ID, location=LOCATION)
 
 # LiveAPI Configuration
 config = LiveConnectConfig(
@@ -45,36 +52,31 @@ config = LiveConnectConfig(
 class LiveAPIWebSocketServer(BaseWebSocketServer):
     """WebSocket server implementation using Gemini LiveAPI directly."""
 
-    async def process_audio(self, websocket, client_id):
-        # Store reference to client
-        self.active_clients[client_id] = websocket
-
+    async def process_audio(self, websocket, client_id, out_q):
         # Connect to Gemini using LiveAPI
-        async with client.aio.live.connect(model=MODEL, config=config) as session:
+        async with get_genai_client().aio.live.connect(model=MODEL, config=config) as session:
             async with asyncio.TaskGroup() as tg:
                 # Create a queue for audio data from the client
-                audio_queue = asyncio.Queue()
+                audio_queue = asyncio.Queue(maxsize=AUDIO_QUEUE_SIZE)
 
                 # Task to process incoming WebSocket messages
                 async def handle_websocket_messages():
                     async for message in websocket:
                         try:
-                            data = json.loads(message)
+                            data = await decode_msg_async(websocket, message)
                             if data.get("type") == "audio":
-                                # Decode base64 audio data
-                                audio_bytes = base64.b64decode(data.get("data", ""))
-                                # Put audio in queue for processing
-                                await audio_queue.put(audio_bytes)
+                                # Put raw PCM audio in queue, dropping the oldest chunk if the uplink lags
+                                put_latest(audio_queue, data.get("data", b""))
                             elif data.get("type") == "end":
                                 # Client is done sending audio for this turn
                                 logger.info("Received end signal from client")
                             elif data.get("type") == "text":
                                 # Handle text messages (not implemented in this simple version)
-                                logger.info(f"Received text: {data.get('data')}")
-                        except json.JSONDecodeError:
-                            logger.error("Invalid JSON message received")
+                                logger.info("Received text: %s", data.get("data"))
+                        except ValueError:
+                            logger.error("Invalid message received")
                         except Exception as e:
-                            logger.error(f"Error processing message: {e}")
+                            logger.error("Error processing message: %s", e)
 
                 # Task to process and send audio to Gemini
                 async def process_and_send_audio():
@@ -103,63 +105,58 @@ class LiveAPIWebSocketServer(BaseWebSocketServer):
                                 update = response.session_resumption_update
                                 if update.resumable and update.new_handle:
                                     session_id = update.new_handle
-                                    logger.info(f"New SESSION: {session_id}")
+                                    logger.info("New SESSION: %s", session_id)
                                     # Send session ID to client
-                                    session_id_msg = json.dumps({
+                                    await out_q.put({
                                         "type": "session_id",
                                         "data": session_id
                                     })
-                                    await websocket.send(session_id_msg)
 
                             # Check if connection will be terminated soon
                             if response.go_away is not None:
-                                logger.info(f"Session will terminate in: {response.go_away.time_left}")
+                                logger.info("Session will terminate in: %s", response.go_away.time_left)
 
                             server_content = response.server_content
 
                             # Handle interruption
-                            if (hasattr(server_content, "interrupted") and server_content.interrupted):
+                            if getattr(server_content, "interrupted", None):
                                 logger.info("🤐 INTERRUPTION DETECTED")
                                 # Just notify the client - no need to handle audio on server side
-                                await websocket.send(json.dumps({
-                                    "type": "interrupted",
-                                    "data": "Response interrupted by user input"
-                                }))
+                                await out_q.put(INTERRUPTED_MSG)
 
                             # Process model response
                             if server_content and server_content.model_turn:
                                 for part in server_content.model_turn.parts:
-                                    if part.inline_data:
+                                    inline_data = part.inline_data
+                                    if inline_data and inline_data.data:
                                         # Send audio to client only (don't play locally)
-                                        b64_audio = base64.b64encode(part.inline_data.data).decode('utf-8')
-                                        await websocket.send(json.dumps({
+                                        await out_q.put({
                                             "type": "audio",
-                                            "data": b64_audio
-                                        }))
+                                            "data": inline_data.data
+                                        })
 
                             # Handle turn completion
                             if server_content and server_content.turn_complete:
                                 logger.info("✅ Gemini done talking")
-                                await websocket.send(json.dumps({
-                                    "type": "turn_complete"
-                                }))
+                                await out_q.put(TURN_COMPLETE_MSG)
 
                             # Handle transcriptions
                             output_transcription = getattr(response.server_content, "output_transcription", None)
                             if output_transcription and output_transcription.text:
                                 output_transcriptions.append(output_transcription.text)
                                 # Send text to client
-                                await websocket.send(json.dumps({
+                                await out_q.put({
                                     "type": "text",
                                     "data": output_transcription.text
-                                }))
+                                })
 
                             input_transcription = getattr(response.server_content, "input_transcription", None)
                             if input_transcription and input_transcription.text:
                                 input_transcriptions.append(input_transcription.text)
 
-                        logger.info(f"Output transcription: {''.join(output_transcriptions)}")
-                        logger.info(f"Input transcription: {''.join(input_transcriptions)}")
+                        if logger.isEnabledFor(logging.INFO):
+                            logger.info("Output transcription: %s", "".join(output_transcriptions))
+                            logger.info("Input transcription: %s", "".join(input_transcriptions))
 
                 # Start all tasks
                 tg.create_task(handle_websocket_messages())
@@ -173,10 +170,10 @@ async def main():
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        run_event_loop(main())
     except KeyboardInterrupt:
         logger.info("Exiting application via KeyboardInterrupt...")
     except Exception as e:
-        logger.error(f"Unhandled exception in main: {e}")
+        logger.error("Unhandled exception in main: %s", e)
         import traceback
         traceback.print_exc()
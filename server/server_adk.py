@@ -1,6 +1,5 @@
 import asyncio
-import json
-import base64
+import logging
 
 # Import Google ADK components
 from google.adk.agents import Agent, LiveRequestQueue
@@ -16,15 +15,17 @@ load_dotenv()
 # Import common components
 from common import (
     BaseWebSocketServer,
+    decode_msg_async,
     logger,
     MODEL,
     VOICE_NAME,
     SEND_SAMPLE_RATE,
     SYSTEM_INSTRUCTION,
     get_order_status,
-    PROJECT_ID,
-    LOCATION,
-    RAG_CORPUS_ID,
+    run_event_loop,
+    TURN_COMPLETE_MSG,
+    INTERRUPTED_MSG,
+    SEARCH_DATA_STORE_ID,
 )
 
 
@@ -47,9 +48,14 @@ class ADKWebSocketServer(BaseWebSocketServer):
     def __init__(self, host="0.0.0.0", port=8765):
         super().__init__(host, port)
 
+        if not SEARCH_DATA_STORE_ID:
+            raise ValueError(
+                "VERTEX_AI_SEARCH_DATA_STORE_ID must be set to a Vertex AI Search data store"
+            )
+
         # RAG tool using Vertex AI Search
         rag_tool = VertexAiSearchTool(
-            data_store_id=RAG_CORPUS_ID
+            data_store_id=SEARCH_DATA_STORE_ID
         )
 
         # Initialize ADK components
@@ -63,29 +69,15 @@ class ADKWebSocketServer(BaseWebSocketServer):
         # Create session service
         self.session_service = InMemorySessionService()
 
-    async def process_audio(self, websocket, client_id):
-        # Store reference to client
-        self.active_clients[client_id] = websocket
-
-        # Create session for this client
-        session = self.session_service.create_session(
-            app_name="audio_assistant",
-            user_id=f"user_{client_id}",
-            session_id=f"session_{client_id}",
-        )
-
-        # Create runner
-        runner = Runner(
+        # Create runner, shared by all client sessions
+        self.runner = Runner(
             app_name="audio_assistant",
             agent=self.agent,
             session_service=self.session_service,
         )
 
-        # Create live request queue
-        live_request_queue = LiveRequestQueue()
-
-        # Create run config with audio settings
-        run_config = RunConfig(
+        # Create run config with audio settings, shared by all client sessions
+        self.run_config = RunConfig(
             streaming_mode=StreamingMode.BIDI,
             speech_config=types.SpeechConfig(
                 voice_config=types.VoiceConfig(
@@ -99,91 +91,91 @@ class ADKWebSocketServer(BaseWebSocketServer):
             input_audio_transcription=types.AudioTranscriptionConfig(),
         )
 
-        # Queue for audio data from the client
-        audio_queue = asyncio.Queue()
+    async def process_audio(self, websocket, client_id, out_q):
+        # Create session for this client
+        session = self.session_service.create_session(
+            app_name="audio_assistant",
+            user_id=f"user_{client_id}",
+            session_id=f"session_{client_id}",
+        )
+
+        # Create live request queue
+        live_request_queue = LiveRequestQueue()
+
+        audio_mime_type = f"audio/pcm;rate={SEND_SAMPLE_RATE}"
 
         async with asyncio.TaskGroup() as tg:
-            # Task to process incoming WebSocket messages
+            # Task to process incoming WebSocket messages and forward audio to Gemini
             async def handle_websocket_messages():
                 async for message in websocket:
                     try:
-                        data = json.loads(message)
+                        data = await decode_msg_async(websocket, message)
                         if data.get("type") == "audio":
-                            # Decode base64 audio data
-                            audio_bytes = base64.b64decode(data.get("data", ""))
-                            # Put audio in queue for processing
-                            await audio_queue.put(audio_bytes)
+                            # Send the audio data to Gemini through ADK's LiveRequestQueue,
+                            # which is non-blocking and already buffers for the uplink
+                            live_request_queue.send_realtime(
+                                types.Blob(data=data.get("data", b""), mime_type=audio_mime_type)
+                            )
                         elif data.get("type") == "end":
                             # Client is done sending audio for this turn
                             logger.info("Received end signal from client")
                         elif data.get("type") == "text":
                             # Handle text messages (not implemented in this simple version)
-                            logger.info(f"Received text: {data.get('data')}")
-                    except json.JSONDecodeError:
-                        logger.error("Invalid JSON message received")
+                            logger.info("Received text: %s", data.get("data"))
+                    except ValueError:
+                        logger.error("Invalid message received")
                     except Exception as e:
-                        logger.error(f"Error processing message: {e}")
-
-            # Task to process and send audio to Gemini
-            async def process_and_send_audio():
-                while True:
-                    data = await audio_queue.get()
-
-                    # Send the audio data to Gemini through ADK's LiveRequestQueue
-                    live_request_queue.send_realtime(
-                        types.Blob(
-                            data=data,
-                            mime_type=f"audio/pcm;rate={SEND_SAMPLE_RATE}",
-                        )
-                    )
-
-                    audio_queue.task_done()
+                        logger.error("Error processing message: %s", e)
 
             # Task to receive and process responses
             async def receive_and_process_responses():
-                # Track user and model outputs between turn completion events
+                # Track user and model outputs between turn completion events,
+                # skipping chunks we've already seen in this turn
                 input_texts = []
                 output_texts = []
+                input_seen = set()
+                output_seen = set()
 
                 # Flag to track if we've seen an interruption in the current turn
                 interrupted = False
 
                 # Process responses from the agent
-                async for event in runner.run_live(
+                async for event in self.runner.run_live(
                     session=session,
                     live_request_queue=live_request_queue,
-                    run_config=run_config,
+                    run_config=self.run_config,
                 ):
 
-                    # Check for turn completion or interruption using string matching
-                    # This is a fallback approach until a proper API exists
-                    event_str = str(event)
-                    #print()
-
                     # Handle audio content
                     if event.content and event.content.parts:
+                        # Check if this is user or model text based on content role
+                        is_user = getattr(event.content, "role", None) == "user"
+
                         for part in event.content.parts:
                             # Process audio content
-                            if hasattr(part, "inline_data") and part.inline_data:
-                                b64_audio = base64.b64encode(part.inline_data.data).decode("utf-8")
-                                await websocket.send(json.dumps({"type": "audio", "data": b64_audio}))
+                            inline_data = getattr(part, "inline_data", None)
+                            if inline_data is not None and inline_data.data:
+                                await out_q.put({"type": "audio", "data": inline_data.data})
 
                             # Process text content
-                            if hasattr(part, "text") and part.text:
-                                # Check if this is user or model text based on content role
-                                if hasattr(event.content, "role") and event.content.role == "user":
+                            text = getattr(part, "text", None)
+                            if text:
+                                if is_user:
                                     # User text shouldn't be sent to the client
-                                    input_texts.append(part.text)
+                                    if text not in input_seen:
+                                        input_seen.add(text)
+                                        input_texts.append(text)
                                 else:
                                     # From the logs, we can see the duplicated text issue happens because
                                     # we get streaming chunks with "partial=True" followed by a final consolidated
                                     # response with "partial=None" containing the complete text
 
-                                    # Check in the event string for the partial flag
-                                    # Only process messages with "partial=True"
-                                    if "partial=True" in event_str:
-                                        await websocket.send(json.dumps({"type": "text", "data": part.text}))
-                                        output_texts.append(part.text)
+                                    # Only process messages with partial=True
+                                    if event.partial is True:
+                                        await out_q.put({"type": "text", "data": text})
+                                        if text not in output_seen:
+                                            output_seen.add(text)
+                                            output_texts.append(text)
                                     # Skip messages with "partial=None" to avoid duplication
 
 
@@ -191,10 +183,7 @@ class ADKWebSocketServer(BaseWebSocketServer):
                     # Check for interruption
                     if event.interrupted  and not interrupted:
                         logger.info("🤐 INTERRUPTION DETECTED")
-                        await websocket.send(json.dumps({
-                            "type": "interrupted",
-                            "data": "Response interrupted by user input"
-                        }))
+                        await out_q.put(INTERRUPTED_MSG)
                         interrupted = True
 
                     # Check for turn completion
@@ -202,27 +191,25 @@ class ADKWebSocketServer(BaseWebSocketServer):
                         # Only send turn_complete if there was no interruption
                         if not interrupted:
                             logger.info("✅ Gemini done talking")
-                            await websocket.send(json.dumps({"type": "turn_complete"}))
+                            await out_q.put(TURN_COMPLETE_MSG)
 
                         # Log collected transcriptions for debugging
-                        if input_texts:
-                            # Get unique texts to prevent duplication
-                            unique_texts = list(dict.fromkeys(input_texts))
-                            logger.info(f"Input transcription: {' '.join(unique_texts)}")
+                        if logger.isEnabledFor(logging.INFO):
+                            if input_texts:
+                                logger.info("Input transcription: %s", " ".join(input_texts))
 
-                        if output_texts:
-                            # Get unique texts to prevent duplication
-                            unique_texts = list(dict.fromkeys(output_texts))
-                            logger.info(f"Output transcription: {' '.join(unique_texts)}")
+                            if output_texts:
+                                logger.info("Output transcription: %s", " ".join(output_texts))
 
                         # Reset for next turn
                         input_texts = []
                         output_texts = []
+                        input_seen = set()
+                        output_seen = set()
                         interrupted = False
 
             # Start all tasks
             tg.create_task(handle_websocket_messages())
-            tg.create_task(process_and_send_audio())
             tg.create_task(receive_and_process_responses())
 
 
@@ -234,10 +221,10 @@ async def main():
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        run_event_loop(main())
     except KeyboardInterrupt:
         logger.info("Exiting application via KeyboardInterrupt...")
     except Exception as e:
-        logger.error(f"Unhandled exception in main: {e}")
+        logger.error("Unhandled exception in main: %s", e)
         import traceback
         traceback.print_exc()